@@ -34,7 +34,6 @@ automl.train_automl_model(
 """
 
 import logging
-import re
 from typing import List
 
 from google.cloud import bigquery
@@ -176,22 +175,23 @@ def create_batch_predictions(
       job_display_name='crystalvalue_job',
       model_name=model_id,
       bigquery_source=bigquery_uri,
-      bigquery_destination_prefix=project_id,
+      bigquery_destination_prefix=f'bq://{project_id}.{dataset_id}',
       location=location)
 
   return batch_prediction
 
 
-def load_predictions_to_table(bigquery_client: bigquery.Client,
-                              dataset_id: str,
-                              batch_predictions: aiplatform.BatchPredictionJob,
-                              location: str = 'europe-west4',
-                              destination_table: str = 'predictions',
-                              model_name: str = 'crystalvalue_model') -> None:
-  """Extracts data from Vertex AI prediction dataset and into workspace.
+def create_predictions_view(bigquery_client: bigquery.Client,
+                            dataset_id: str,
+                            batch_predictions: aiplatform.BatchPredictionJob,
+                            location: str = 'europe-west4',
+                            destination_table: str = 'predictions') -> None:
+  """Exposes batch predictions through a view in the workspace dataset.
 
-  The Vertex AI AutoML automatically puts predictions in a new dataset. This
-  function takes those predictions and puts them into the workspace dataset.
+  The batch prediction job writes straight into a timestamped table in the
+  workspace dataset, so rather than copying those rows a second time this
+  creates (or replaces) a view over the latest output table with the cleaned
+  prediction columns.
 
   If any predictions are negative they will be set to 0.
 
@@ -200,24 +200,16 @@ def load_predictions_to_table(bigquery_client: bigquery.Client,
     dataset_id: The Bigquery dataset_id.
     batch_predictions: Vertex AI batch predictions object.
     location: Data processing location.
-    destination_table: Table to load predictions to within the dataset_id.
-    model_name: The name of the trained model.
+    destination_table: View over the predictions within the dataset_id.
   """
-  output_dataset = re.findall('bq://(.*?)\"',
-                              str(batch_predictions.output_info))[0]
-  timestamp = output_dataset.split(model_name)[1]
-  output_table = output_dataset + f'.predictions{timestamp}'
+  output_info = batch_predictions.output_info
+  output_dataset = output_info.bigquery_output_dataset.replace('bq://', '')
+  output_table = f'{output_dataset}.{output_info.bigquery_output_table}'
 
-  prediction_table = f'{bigquery_client.project}.{dataset_id}.{destination_table}'
-
-  tables = [table.table_id for table in bigquery_client.list_tables(dataset_id)]
-  if prediction_table.split('.')[-1] in tables:
-    bigquery_option = f'INSERT INTO {prediction_table}'
-  else:
-    bigquery_option = f'CREATE TABLE {prediction_table} AS'
+  view_id = f'{bigquery_client.project}.{dataset_id}.{destination_table}'
 
   query = f"""
-  {bigquery_option}
+  CREATE OR REPLACE VIEW `{view_id}` AS
   SELECT
     customer_id,
     lookahead_start,
@@ -228,6 +220,7 @@ def load_predictions_to_table(bigquery_client: bigquery.Client,
   FROM `{output_table}`
   """
   bigquery_client.query(query, location=location).result()
+  logging.info('Created predictions view %r over %r', view_id, output_table)
 
 
 def deploy_model(bigquery_client: bigquery.Client,
@@ -47,8 +47,23 @@ summary_statistics = pipeline.run_data_checks(
 # CrystalValue automatically detects data types and applies transformations.
 # CrystalValue by default will predict 1 year ahead using data
 # accumulated from 1 year before (configurable).
-training_data = pipeline.feature_engineer(
-    transaction_table_name='synthetic_data')
+# Training reads the feature table directly from BigQuery so the features
+# are not downloaded; pass download=True to inspect them as a DataFrame.
+pipeline.feature_engineer(transaction_table_name='synthetic_data')
+
+# Queries without data dependencies on each other can also be submitted as
+# asynchronous BigQuery jobs and awaited together, so the wall time is the
+# slowest job rather than the sum. For example, to build the training and
+# prediction features concurrently (gather waits for the jobs and returns
+# the feature table references; training and prediction read the tables
+# directly from BigQuery):
+training_job = pipeline.feature_engineer(
+    transaction_table_name='synthetic_data', wait=False)
+predict_job = pipeline.feature_engineer(
+    transaction_table_name='synthetic_data',
+    query_type='predict_query',
+    wait=False)
+pipeline.gather([training_job, predict_job])
 
 # Model training.
 # (Optional) Give a custom model to the training function to be trained.
@@ -70,7 +85,7 @@ pipeline.deploy_model()
 pipeline.evaluate_model()
 
 # Run feature engineering for the set of data you want to predict on.
-predict_features_data = pipeline.feature_engineer(
+pipeline.feature_engineer(
     transaction_table_name='synthetic_data',
     query_type='predict_query')
 
@@ -83,9 +98,9 @@ pipeline.batch_predict(
 
 import dataclasses
 import json
-from typing import Any, Collection, Dict, List, Mapping, Optional
+import logging
+from typing import Any, Collection, Dict, List, Mapping, Optional, Union
 
-from absl import logging
 from google.cloud import bigquery
 from google.cloud import storage
 from google.cloud import aiplatform
@@ -100,15 +115,18 @@ from src import model_evaluation
 from src import synthetic_data
 
 
+_logger = logging.getLogger(__name__)
+
+
 def load_parameters_from_file(
     filename: str = 'crystalvalue_parameters.json') -> Dict[str, str]:
   """Reads parameters from local file."""
-  logging.info('Reading parameters from file %r', filename)
+  _logger.info('Reading parameters from file %r', filename)
   with open(filename) as f:
     return json.load(f)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(eq=False, repr=False, slots=True)
 class CrystalValue:
   """Class to train and predict LTV model.
 
@@ -134,6 +152,11 @@ class CrystalValue:
       'europe-west4' or 'us-east-4')
     days_lookback: The number of days to look back to create features.
     days_lookahead: The number of days to look ahead to predict value.
+    refresh_interval_minutes: How frequently BigQuery refreshes the
+      materialized views holding the training and prediction features.
+    max_bytes_billed: If set, queries are dry run first and rejected when
+      they would process more than this many bytes, protecting against
+      runaway costs from misconfigured lookback windows.
     model_id: The ID of the model that will be created.
     endpoint_id: The ID of the endpoint that will be created for a deployed
       model.
@@ -161,24 +184,29 @@ class CrystalValue:
   location: str = 'europe-west4'
   days_lookback: int = 365
   days_lookahead: int = 365
+  refresh_interval_minutes: int = 60
+  max_bytes_billed: Optional[int] = None
   model_id: Optional[str] = None
   endpoint_id: Optional[str] = None
   write_parameters: bool = False
   parameters_filename: str = 'crystalvalue_parameters.json'
+  features_types: Optional[Mapping[str, List[str]]] = None
   bigquery_client: Optional[bigquery.Client] = None
 
   def __post_init__(self):
-    logging.info('Using Google Cloud Project: %r', self.project_id)
-    logging.info('Using dataset_id: %r', self.dataset_id)
-    logging.info('Using Google Cloud location: %r', self.location)
-    logging.info('Using customer id column in input table: %r',
-                 self.customer_id_column)
-    logging.info('Using date column in input table: %r', self.date_column)
-    logging.info('Using value column in input table: %r', self.value_column)
-    logging.info('Using days_lookback for feature calculation: %r',
-                 self.days_lookback)
-    logging.info('Using days_lookahead for value prediction: %r',
-                 self.days_lookahead)
+    if _logger.isEnabledFor(logging.INFO):
+      _logger.info(
+          'CrystalValue initialized: %s',
+          json.dumps({
+              'project_id': self.project_id,
+              'dataset_id': self.dataset_id,
+              'location': self.location,
+              'customer_id_column': self.customer_id_column,
+              'date_column': self.date_column,
+              'value_column': self.value_column,
+              'days_lookback': self.days_lookback,
+              'days_lookahead': self.days_lookahead,
+          }))
     self.bigquery_client = bigquery.Client(
         project=self.project_id,
         location=self.location,
@@ -186,7 +214,7 @@ class CrystalValue:
     try:
       self.bigquery_client.get_dataset(self.dataset_id)
     except NotFound:
-      logging.info('Dataset %r not found, creating the dataset %r '
+      _logger.info('Dataset %r not found, creating the dataset %r '
                    'in project %r in location %r',
                    self.dataset_id, self.dataset_id, self.project_id,
                    self.location)
@@ -210,7 +238,7 @@ class CrystalValue:
     }
     with open(self.parameters_filename, 'w') as f:
       json.dump(parameters, f)
-    logging.info('Parameters writen to file: %r',
+    _logger.info('Parameters writen to file: %r',
                  self.parameters_filename)
 
   def create_synthetic_data(self,
@@ -275,7 +303,10 @@ class CrystalValue:
       self,
       transaction_table_name: str,
       query_type: str = 'train_query',
-      write_executed_query_file: Optional[str] = None) -> pd.DataFrame:
+      write_executed_query_file: Optional[str] = None,
+      wait: bool = True,
+      download: bool = False
+  ) -> Union[pd.DataFrame, bigquery.table.Table, bigquery.QueryJob]:
     """Builds train or predict query from transaction data through BigQuery.
 
     This function takes a transaction dataset (a BigQuery table that includes
@@ -290,9 +321,21 @@ class CrystalValue:
       query_type: The query type. Has to be one of the keys in
         feature_engineering._QUERY_TEMPLATE_FILES.
       write_executed_query_file: File path to write the generated SQL query.
+      wait: Whether to wait for the feature query to finish. If False, the
+        query is submitted as an asynchronous BigQuery job which is returned
+        so it can run concurrently with other jobs and be awaited later with
+        `gather`.
+      download: Whether to download the generated features into a Pandas
+        DataFrame. Training and batch prediction read the feature tables
+        directly from BigQuery, so by default only the table reference is
+        returned; pass True for interactive inspection or when feeding the
+        features to `predict`, which scores a DataFrame through the model
+        endpoint.
 
     Returns:
-      The SQL script to generate training data ready for machine learning.
+      A reference to the generated feature table (or the features as a
+      DataFrame if `download`), or the pending BigQuery job if `wait` is
+      False.
     """
     if not self.input_data_types:
       if not self.ignore_columns:
@@ -309,9 +352,9 @@ class CrystalValue:
         raise ValueError('No features detected')
       for feature_type in self.input_data_types:
         for feature in self.input_data_types[feature_type]:
-          logging.info('Detected %r feature %r', feature_type, feature)
+          _logger.info('Detected %r feature %r', feature_type, feature)
 
-    query, features_types = feature_engineering.build_query(
+    query, features_types, query_parameters = feature_engineering.build_query(
         query_type=query_type,
         bigquery_client=self.bigquery_client,
         dataset_id=self.dataset_id,
@@ -329,12 +372,42 @@ class CrystalValue:
     elif query_type == 'predict_query':
       table_name = self.predict_table_name
 
-    return self.run_query(query_sql=query, destination_table_name=table_name)
-
-  def run_query(self,
-                destination_table_name: str,
-                query_sql: Optional[str] = None,
-                query_file: Optional[str] = None) -> pd.DataFrame:
+    if not wait:
+      return feature_engineering.run_query_async(
+          bigquery_client=self.bigquery_client,
+          dataset_id=self.dataset_id,
+          destination_table_name=table_name,
+          query_sql=query,
+          location=self.location,
+          query_parameters=query_parameters,
+          time_partitioning_field=(
+              feature_engineering.FEATURE_TABLE_PARTITION_COLUMN),
+          clustering_fields=(
+              feature_engineering.FEATURE_TABLE_CLUSTERING_COLUMNS),
+          max_bytes_billed=self.max_bytes_billed)
+    return feature_engineering.run_materialized_view_query(
+        bigquery_client=self.bigquery_client,
+        dataset_id=self.dataset_id,
+        destination_table_name=table_name,
+        query_sql=query,
+        location=self.location,
+        refresh_interval_minutes=self.refresh_interval_minutes,
+        query_parameters=query_parameters,
+        download=download,
+        time_partitioning_field=(
+            feature_engineering.FEATURE_TABLE_PARTITION_COLUMN),
+        clustering_fields=(
+            feature_engineering.FEATURE_TABLE_CLUSTERING_COLUMNS),
+        max_bytes_billed=self.max_bytes_billed)
+
+  def run_query(
+      self,
+      destination_table_name: str,
+      query_sql: Optional[str] = None,
+      query_file: Optional[str] = None,
+      query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None,
+      download: bool = False
+  ) -> Union[pd.DataFrame, bigquery.table.Table]:
     """Runs a query in Bigquery either using a file or a query string.
 
     One of query_sql or query_file must be provided.
@@ -343,9 +416,15 @@ class CrystalValue:
       destination_table_name: Bigquery destination table name.
       query_sql: The SQL query to execute.
       query_file: Path to the SQL query to execute.
+      query_parameters: Parameters to bind to `@name` placeholders in the
+        query.
+      download: Whether to download the result into a Pandas DataFrame
+        rather than only returning the destination table reference. Pass
+        True when the result is consumed in memory, e.g. by `predict`.
 
     Returns:
-      Training data ready for machine learning.
+      A reference to the destination table, or the result as a DataFrame if
+      `download`.
     """
     return feature_engineering.run_query(
         bigquery_client=self.bigquery_client,
@@ -353,7 +432,71 @@ class CrystalValue:
         query_file=query_file,
         dataset_id=self.dataset_id,
         destination_table_name=destination_table_name,
-        location=self.location)
+        location=self.location,
+        query_parameters=query_parameters,
+        download=download,
+        max_bytes_billed=self.max_bytes_billed)
+
+  def run_query_async(
+      self,
+      destination_table_name: str,
+      query_sql: Optional[str] = None,
+      query_file: Optional[str] = None,
+      query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None
+  ) -> bigquery.QueryJob:
+    """Submits a query to Bigquery without waiting for it to complete.
+
+    Jobs with no data dependency on each other (for instance the training and
+    prediction feature queries) can be submitted together and awaited
+    concurrently with `gather`.
+
+    Args:
+      destination_table_name: Bigquery destination table name.
+      query_sql: The SQL query to execute.
+      query_file: Path to the SQL query to execute.
+      query_parameters: Parameters to bind to `@name` placeholders in the
+        query.
+
+    Returns:
+      The pending BigQuery query job.
+    """
+    return feature_engineering.run_query_async(
+        bigquery_client=self.bigquery_client,
+        query_sql=query_sql,
+        query_file=query_file,
+        dataset_id=self.dataset_id,
+        destination_table_name=destination_table_name,
+        location=self.location,
+        query_parameters=query_parameters,
+        max_bytes_billed=self.max_bytes_billed)
+
+  def gather(
+      self,
+      jobs: Collection[bigquery.QueryJob],
+      download: bool = False
+  ) -> List[Union[pd.DataFrame, bigquery.table.Table]]:
+    """Waits for asynchronous BigQuery jobs and returns their results.
+
+    Args:
+      jobs: The pending BigQuery jobs, e.g. from `feature_engineer` or
+        `run_query_async` with `wait=False`.
+      download: Whether to download each job's result into a Pandas
+        DataFrame. Training and batch prediction read the destination
+        tables directly from BigQuery, so by default only the table
+        references are returned, mirroring `run_query`.
+
+    Returns:
+      A reference to each job's destination table (or its result as a
+      DataFrame if `download`), in the order given.
+    """
+    results = []
+    for job in jobs:
+      if download:
+        results.append(job.result().to_dataframe(create_bqstorage_client=True))
+      else:
+        job.result()
+        results.append(self.bigquery_client.get_table(job.destination))
+    return results
 
   def train_custom_model(
       self,
@@ -487,18 +630,19 @@ class CrystalValue:
   def batch_predict(self,
                     input_table_name: str,
                     model_id: Optional[str] = None,
-                    model_name: str = 'crystalvalue_model',
                     destination_table: str = 'crystalvalue_predictions'):
     """Creates predictions using Vertex AI model into destination table.
 
+    The batch prediction job writes directly into a timestamped table in
+    your dataset and `destination_table` is a view over the latest output,
+    so predictions are not copied a second time.
+
     Args:
       input_table_name: The table containing features to predict with.
       model_id: The resource name of the Vertex AI model e.g.
         '553728129496821'
-      model_name: The name of the Vertex AI trained model e.g.
-        'crystalvalue_model'.
-      destination_table: The table to either create (if it doesn't exist) or
-        append predictions to within your dataset.
+      destination_table: The view over the latest predictions to create (or
+        replace) within your dataset.
     """
     if not model_id:
       model_id = self.model_id
@@ -509,13 +653,12 @@ class CrystalValue:
         table_name=input_table_name,
         location=self.location)
 
-    automl.load_predictions_to_table(
+    automl.create_predictions_view(
         bigquery_client=self.bigquery_client,
         dataset_id=self.dataset_id,
         batch_predictions=batch_predictions,
         location=self.location,
-        destination_table=destination_table,
-        model_name=model_name)
+        destination_table=destination_table)
 
   def predict(self,
               input_table: pd.DataFrame,
@@ -570,12 +713,12 @@ class CrystalValue:
       self.bigquery_client.get_table(table_id)
       job_config = bigquery.job.LoadJobConfig(
           write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
-      logging.info('Appending to table %r in location %r', table_id,
+      _logger.info('Appending to table %r in location %r', table_id,
                    self.location)
     except NotFound:
       job_config = bigquery.job.LoadJobConfig(
           write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
-      logging.info('Creating table %r in location %r', table_id, self.location)
+      _logger.info('Creating table %r in location %r', table_id, self.location)
 
     self.bigquery_client.load_table_from_dataframe(
         dataframe=output,
@@ -606,7 +749,9 @@ class CrystalValue:
                      model_id: Optional[str] = None,
                      endpoint_id: Optional[str] = None,
                      table_evaluation_stats: str = 'crystalvalue_evaluation',
-                     number_bins: int = 10) -> pd.DataFrame:
+                     number_bins: int = 10,
+                     use_approx: bool = True,
+                     use_bigquery: bool = False) -> pd.DataFrame:
     """Creates a plot and Big Query table with evaluation metrics for LTV model.
 
     Args:
@@ -617,6 +762,12 @@ class CrystalValue:
       table_evaluation_stats: Destination BigQuery Table to store model results.
       number_bins: Number of bins to split the LTV predictions into for
         evaluation. The default split is into deciles.
+      use_approx: Whether to assign bins using approximate quantile boundaries
+        rather than an exact global rank, which scales better on large test
+        sets. Only used when `use_bigquery` is False.
+      use_bigquery: Whether to compute the evaluation metrics inside BigQuery
+        rather than in memory. The scored test set is already local, so this
+        adds an upload; it mainly helps when local memory is tight.
 
     Returns:
       Model evaluation metrics on the test set.
@@ -642,13 +793,15 @@ class CrystalValue:
         model_id=self.model_id,
         table_evaluation_stats=table_evaluation_stats,
         location=self.location,
-        number_bins=number_bins)
+        number_bins=number_bins,
+        use_approx=use_approx,
+        use_bigquery=use_bigquery)
 
   def delete_table(self, table_name: str) -> None:
     """Deletes a Bigquery table."""
     table_id = f'{self.project_id}.{self.dataset_id}.{table_name}'
     self.bigquery_client.delete_table(table_id, not_found_ok=True)
-    logging.info('Deleted table %r', table_id)
+    _logger.info('Deleted table %r', table_id)
 
   def create_storage_bucket(
       self, bucket_name: Optional[str] = None) -> storage.Bucket:
@@ -660,7 +813,7 @@ class CrystalValue:
     bucket = storage_client.create_bucket(
         bucket_or_name=bucket_name,
         location=self.location)
-    logging.info('Created storage bucket with name %r', bucket_name)
+    _logger.info('Created storage bucket with name %r', bucket_name)
     return bucket
 
   def load_dataframe_to_bigquery(self, data: pd.DataFrame,
@@ -382,7 +382,8 @@ def train_custom_model(custom_model: Model,
       WHERE predefined_split_column = 'TRAIN'
       """
   data = bigquery_client.query(
-      query_sql, location=location).result().to_dataframe()
+      query_sql, location=location).result().to_dataframe(
+          create_bqstorage_client=True)
 
   embedding_model_path = None
   if feature_types['string_or_categorical']:
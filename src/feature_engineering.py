@@ -16,9 +16,12 @@
 import collections
 import datetime
 import logging
-from typing import Collection, Dict, List, Mapping, Optional, Tuple
+from typing import Collection, Dict, List, Mapping, Optional, Tuple, Union
 
 from google.cloud import bigquery
+from google.cloud.exceptions import BadRequest
+from google.cloud.exceptions import Conflict
+from google.cloud.exceptions import NotFound
 import numpy as np
 import pandas as pd
 
@@ -38,6 +41,11 @@ _STATIC_NUMERIC_FEATURES = ('days_since_last_transaction',
                             'days_since_first_transaction',
                             'count_transactions')
 
+# Columns the SQL templates create in every feature table, used to partition
+# and cluster the destination tables for cheap downstream filtered reads.
+FEATURE_TABLE_PARTITION_COLUMN = 'window_date'
+FEATURE_TABLE_CLUSTERING_COLUMNS = ['customer_id']
+
 
 def run_load_table_to_bigquery(
     data: pd.DataFrame,
@@ -119,7 +127,7 @@ def run_data_checks(
 
   SELECT
     base_table.*,
-    COUNT(DISTINCT customer_dates.{date_column}) AS future_purchase_dates
+    APPROX_COUNT_DISTINCT(customer_dates.{date_column}) AS future_purchase_dates
   FROM
     base_table
   LEFT JOIN
@@ -129,7 +137,9 @@ def run_data_checks(
     AND DATE(customer_dates.{date_column}) BETWEEN base_table.lookahead_start AND base_table.lookahead_stop)
   GROUP BY 1,2,3,4,5
   """
-  data = bigquery_client.query(query, location=location).result().to_dataframe()
+  data = bigquery_client.query(
+      query, location=location).result().to_dataframe(
+          create_bqstorage_client=True)
 
   data[date_column] = pd.to_datetime(data[date_column]).dt.date
   max_date = data[date_column].max()
@@ -223,9 +233,15 @@ def detect_column_types(bigquery_client: bigquery.Client,
   logging.info(
       'Detecting features types in project_id %r in dataset %r in table %r',
       bigquery_client.project, dataset_id, table_name)
+  return _column_types_from_schema(table.schema, ignore_columns)
 
+
+def _column_types_from_schema(
+    schema: List[bigquery.SchemaField],
+    ignore_columns: List[str]) -> Dict[str, List[str]]:
+  """Maps a BigQuery schema to column types used for feature engineering."""
   input_data_types = collections.defaultdict(list)
-  for feature in table.schema:
+  for feature in schema:
     if feature.name not in ignore_columns:
       if feature.field_type == 'BOOLEAN':
         input_data_types['boolean'].append(feature.name)
@@ -260,7 +276,9 @@ def build_query(
     days_lookahead: int = 365,
     customer_id_column: str = 'customer_id',
     date_column: str = 'date',
-    value_column: str = 'value') -> Tuple[str, Mapping[str, List[str]]]:
+    value_column: str = 'value'
+) -> Tuple[str, Mapping[str, List[str]],
+           List[bigquery.ScalarQueryParameter]]:
   """Builds training or prediction query from transaction data through BigQuery.
 
   This function takes a transaction dataset (a BigQuery table that includes
@@ -290,7 +308,11 @@ def build_query(
   Returns:
     The SQL script to generate training data ready for machine learning along
     side with a mapping of the column type and list of columns of that type
-    thave have been created in the training table.
+    thave have been created in the training table, and the query parameters
+    to bind when running the script. Scalar knobs such as `days_lookback` are
+    bound as query parameters rather than substituted into the SQL text so
+    the query text (and therefore its cache key) stays stable across
+    parameter sweeps.
   """
   if query_type not in _QUERY_TEMPLATE_FILES:
     raise ValueError(
@@ -328,26 +350,193 @@ def build_query(
       customer_id_column=customer_id_column,
       date_column=date_column,
       value_column=value_column,
-      days_lookback=days_lookback,
-      days_lookahead=days_lookahead,
       features_sql=', \n'.join(features_list))
+  query_parameters = [
+      bigquery.ScalarQueryParameter('days_lookback', 'INT64', days_lookback),
+      bigquery.ScalarQueryParameter('days_lookahead', 'INT64', days_lookahead),
+  ]
 
   if write_executed_query_file:
-    _write_file(substituted_query, write_executed_query_file)
+    # The written file is meant for manual modification and re-running via
+    # `run_query(query_file=...)`, so inline the parameter values rather than
+    # leaving `@name` placeholders the caller would have to re-bind.
+    _write_file(
+        _substitute_query_parameters(substituted_query, query_parameters),
+        write_executed_query_file)
     logging.info('Query successfully written to: "%r"',
                  write_executed_query_file)
-  return substituted_query, features_types
+  return substituted_query, features_types, query_parameters
 
 
-def run_query(
+def _substitute_query_parameters(
+    query_sql: str,
+    query_parameters: List[bigquery.ScalarQueryParameter]) -> str:
+  """Inlines scalar parameter values into `@name` placeholders.
+
+  BigQuery DDL statements such as CREATE MATERIALIZED VIEW do not accept
+  query parameters, so the values are substituted into the SQL text instead.
+  """
+  for parameter in query_parameters:
+    query_sql = query_sql.replace(f'@{parameter.name}', str(parameter.value))
+  return query_sql
+
+
+def _is_same_materialized_view(table: bigquery.table.Table,
+                               query_sql: str) -> bool:
+  """Whether `table` is a materialized view with the given definition."""
+  if table.table_type != 'MATERIALIZED_VIEW' or not table.mview_query:
+    return False
+  return ' '.join(table.mview_query.split()) == ' '.join(query_sql.split())
+
+
+def run_materialized_view_query(
+    bigquery_client: bigquery.Client,
+    dataset_id: str,
+    destination_table_name: str,
+    query_sql: str,
+    location: str = 'europe-west4',
+    refresh_interval_minutes: int = 60,
+    query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None,
+    download: bool = False,
+    time_partitioning_field: Optional[str] = None,
+    clustering_fields: Optional[List[str]] = None,
+    max_bytes_billed: Optional[int] = None,
+) -> Union[pd.DataFrame, bigquery.table.Table]:
+  """Materializes a query as an incrementally maintained view in BigQuery.
+
+  A materialized view is refreshed incrementally by BigQuery from the base
+  transaction table, so repeat train/predict feature generation only scans
+  new rows rather than recomputing the full query. An existing view with an
+  unchanged definition is reused; if the definition differs (for example new
+  lookback windows) the view is dropped and recreated. If the query uses
+  features which are not supported in materialized views, this falls back to
+  writing a standard table via `run_query`; once such a table exists under
+  the destination name, later runs refresh it through `run_query` directly.
+
+  Args:
+    bigquery_client: BigQuery client.
+    dataset_id: The Bigquery dataset_id.
+    destination_table_name: The materialized view to create.
+    query_sql: The SQL query to materialize.
+    location: The location to write the view in BigQuery.
+    refresh_interval_minutes: How frequently BigQuery refreshes the view.
+    query_parameters: Parameters to bind to `@name` placeholders in the query.
+    download: Whether to download the materialized data into a Pandas
+      DataFrame rather than only returning the view reference.
+    time_partitioning_field: Date column to partition the destination table
+      on when falling back to a standard table. Materialized views inherit
+      partitioning from their base table so the hint is not applied to the
+      view itself.
+    clustering_fields: Columns to cluster the destination table on when
+      falling back to a standard table.
+    max_bytes_billed: If set, the query is rejected when a dry run estimates
+      it would process more than this many bytes.
+
+  Returns:
+    The materialized data as a Pandas DataFrame if `download`, otherwise a
+    reference to the materialized view.
+  """
+  table_id = f'{bigquery_client.project}.{dataset_id}.{destination_table_name}'
+  # DDL statements cannot bind query parameters, so the materialized view is
+  # created from SQL with the parameter values inlined. The fallback path
+  # binds the parameters instead, keeping the query text (and therefore its
+  # cache key) stable across parameter sweeps.
+  materialized_sql = query_sql
+  if query_parameters:
+    materialized_sql = _substitute_query_parameters(query_sql, query_parameters)
+  materialized_sql = materialized_sql.rstrip().rstrip(';')
+
+  try:
+    existing_table = bigquery_client.get_table(table_id)
+  except NotFound:
+    existing_table = None
+
+  if (existing_table is not None
+      and existing_table.table_type != 'MATERIALIZED_VIEW'):
+    # A standard table under this name means an earlier run already fell
+    # back because the query is not materializable. Refresh it through
+    # `run_query`, whose WRITE_TRUNCATE replaces the table atomically,
+    # instead of deleting it and re-attempting a doomed CREATE MATERIALIZED
+    # VIEW.
+    logging.info('Refreshing existing standard table %r', table_id)
+    return run_query(
+        bigquery_client=bigquery_client,
+        dataset_id=dataset_id,
+        destination_table_name=destination_table_name,
+        query_sql=query_sql,
+        location=location,
+        query_parameters=query_parameters,
+        download=download,
+        time_partitioning_field=time_partitioning_field,
+        clustering_fields=clustering_fields,
+        max_bytes_billed=max_bytes_billed)
+
+  if existing_table is not None and _is_same_materialized_view(
+      existing_table, materialized_sql):
+    logging.info('Reusing materialized view %r with unchanged definition',
+                 table_id)
+  else:
+    # Run the cost gate before touching the existing view so an over-budget
+    # query leaves it in place.
+    if max_bytes_billed is not None:
+      _check_query_cost(
+          _dry_run_query(bigquery_client, materialized_sql, location),
+          max_bytes_billed)
+    if existing_table is not None:
+      # The view was built from a different query (e.g. new lookback
+      # windows); CREATE MATERIALIZED VIEW cannot replace it.
+      logging.info('Replacing materialized view %r as its definition changed',
+                   table_id)
+      bigquery_client.delete_table(table_id, not_found_ok=True)
+    create_view_query = f"""
+    CREATE MATERIALIZED VIEW `{table_id}`
+    OPTIONS (enable_refresh = TRUE,
+             refresh_interval_minutes = {refresh_interval_minutes})
+    AS {materialized_sql}
+    """
+    try:
+      bigquery_client.query(create_view_query, location=location).result()
+      logging.info('Created materialized view %r in location %r', table_id,
+                   location)
+    except (BadRequest, Conflict, NotFound):
+      logging.info(
+          'Could not create materialized view %r, '
+          'falling back to a standard table', table_id)
+      return run_query(
+          bigquery_client=bigquery_client,
+          dataset_id=dataset_id,
+          destination_table_name=destination_table_name,
+          query_sql=query_sql,
+          location=location,
+          query_parameters=query_parameters,
+          download=download,
+          time_partitioning_field=time_partitioning_field,
+          clustering_fields=clustering_fields,
+          max_bytes_billed=max_bytes_billed)
+  if download:
+    return bigquery_client.query(
+        f'SELECT * FROM `{table_id}`',
+        location=location).result().to_dataframe(
+            create_bqstorage_client=True)
+  return bigquery_client.get_table(table_id)
+
+
+def run_query_async(
     bigquery_client: bigquery.Client,
     dataset_id: str,
     destination_table_name: str = 'training_data',
     query_sql: Optional[str] = None,
     query_file: Optional[str] = None,
     location: str = 'europe-west4',
-) -> pd.DataFrame:
-  """Runs a query in BigQuery and returns the result.
+    query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None,
+    time_partitioning_field: Optional[str] = None,
+    clustering_fields: Optional[List[str]] = None,
+    max_bytes_billed: Optional[int] = None,
+) -> bigquery.QueryJob:
+  """Submits a query to BigQuery without waiting for it to complete.
+
+  The returned job can run concurrently with other BigQuery jobs that have
+  no data dependency on it; call `job.result()` to wait for completion.
 
   Args:
     bigquery_client: BigQuery client.
@@ -356,9 +545,22 @@ def run_query(
     query_sql: The SQL query to execute.
     query_file: Path to the SQL query to execute.
     location: The location to write the table in BigQuery.
+    query_parameters: Parameters to bind to `@name` placeholders in the query.
+    time_partitioning_field: Date column to partition the destination table
+      on, so downstream date-scoped reads only scan matching partitions. The
+      hint is dropped if the column is not in the query result.
+    clustering_fields: Columns to cluster the destination table on, so
+      downstream filtered reads (e.g. per customer) prune blocks. Columns
+      not in the query result are dropped from the hint.
+    max_bytes_billed: If set, the query is first dry run and rejected when it
+      would process more than this many bytes; the limit is also set on the
+      real job as a hard stop.
 
   Returns:
-    The result of the executed query as a Pandas DataFrame.
+    The submitted BigQuery query job.
+
+  Raises:
+    ValueError: If the query would process more than `max_bytes_billed`.
   """
   if query_file:
     query = _read_file(query_file)
@@ -370,8 +572,133 @@ def run_query(
   table_id = f'{bigquery_client.project}.{dataset_id}.{destination_table_name}'
   job_config = bigquery.QueryJobConfig(
       destination=table_id,
-      write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
-  data = bigquery_client.query(
-      query, job_config=job_config, location=location).result().to_dataframe()
-  logging.info('Created table %r in location %r', table_id, location)
-  return data
+      write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+      query_parameters=query_parameters or [],
+      use_query_cache=True,
+      use_legacy_sql=False,
+      labels={'component': 'crystalvalue'})
+  # Only set when configured: the client serializes an explicit None as the
+  # string 'None', which the BigQuery API rejects as an invalid int64.
+  if max_bytes_billed is not None:
+    job_config.maximum_bytes_billed = max_bytes_billed
+
+  if (max_bytes_billed is not None or time_partitioning_field
+      or clustering_fields):
+    dry_run_job = _dry_run_query(
+        bigquery_client, query, location, query_parameters)
+    _check_query_cost(dry_run_job, max_bytes_billed)
+    result_columns = frozenset(
+        field.name for field in dry_run_job.schema or [])
+    if time_partitioning_field in result_columns:
+      job_config.time_partitioning = bigquery.TimePartitioning(
+          field=time_partitioning_field,
+          type_=bigquery.TimePartitioningType.DAY)
+    if clustering_fields:
+      job_config.clustering_fields = [
+          field for field in clustering_fields if field in result_columns
+      ] or None
+    if job_config.time_partitioning is not None:
+      # WRITE_TRUNCATE cannot change the partitioning spec of an existing
+      # table, so a destination created without partitioning (e.g. by a
+      # previous release) is dropped and recreated with the new spec.
+      try:
+        existing_table = bigquery_client.get_table(table_id)
+      except NotFound:
+        existing_table = None
+      if (existing_table is not None and
+          existing_table.time_partitioning != job_config.time_partitioning):
+        logging.info('Recreating table %r with updated partitioning', table_id)
+        bigquery_client.delete_table(table_id, not_found_ok=True)
+
+  job = bigquery_client.query(query, job_config=job_config, location=location)
+  logging.info('Creating table %r in location %r', table_id, location)
+  return job
+
+
+def _dry_run_query(
+    bigquery_client: bigquery.Client,
+    query: str,
+    location: str,
+    query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None,
+) -> bigquery.QueryJob:
+  """Dry runs a query to estimate its cost and result schema."""
+  job_config = bigquery.QueryJobConfig(
+      dry_run=True,
+      use_query_cache=False,
+      query_parameters=query_parameters or [])
+  return bigquery_client.query(query, job_config=job_config, location=location)
+
+
+def _check_query_cost(dry_run_job: bigquery.QueryJob,
+                      max_bytes_billed: Optional[int]) -> None:
+  """Raises if the estimated bytes processed exceed the configured limit.
+
+  Args:
+    dry_run_job: A completed dry run of the query.
+    max_bytes_billed: The maximum number of bytes the query may process.
+
+  Raises:
+    ValueError: If the query would process more than `max_bytes_billed`.
+  """
+  bytes_processed = dry_run_job.total_bytes_processed
+  logging.info('Query will process %r bytes', bytes_processed)
+  if (max_bytes_billed is not None and bytes_processed is not None
+      and bytes_processed > max_bytes_billed):
+    raise ValueError(
+        f'Query would process {bytes_processed} bytes which exceeds the '
+        f'configured max_bytes_billed of {max_bytes_billed} bytes')
+
+
+def run_query(
+    bigquery_client: bigquery.Client,
+    dataset_id: str,
+    destination_table_name: str = 'training_data',
+    query_sql: Optional[str] = None,
+    query_file: Optional[str] = None,
+    location: str = 'europe-west4',
+    query_parameters: Optional[List[bigquery.ScalarQueryParameter]] = None,
+    download: bool = False,
+    time_partitioning_field: Optional[str] = None,
+    clustering_fields: Optional[List[str]] = None,
+    max_bytes_billed: Optional[int] = None,
+) -> Union[pd.DataFrame, bigquery.table.Table]:
+  """Runs a query in BigQuery and returns the result.
+
+  Args:
+    bigquery_client: BigQuery client.
+    dataset_id: The Bigquery dataset_id.
+    destination_table_name: The table to write to.
+    query_sql: The SQL query to execute.
+    query_file: Path to the SQL query to execute.
+    location: The location to write the table in BigQuery.
+    query_parameters: Parameters to bind to `@name` placeholders in the query.
+    download: Whether to download the result into a Pandas DataFrame.
+      Downstream training and prediction read the destination table directly
+      from BigQuery, so by default only the table reference is returned and
+      the (potentially very large) result is never pulled into memory.
+    time_partitioning_field: Date column to partition the destination table
+      on.
+    clustering_fields: Columns to cluster the destination table on.
+    max_bytes_billed: If set, the query is rejected when a dry run estimates
+      it would process more than this many bytes.
+
+  Returns:
+    The result of the executed query as a Pandas DataFrame if `download`,
+    otherwise a reference to the destination table.
+  """
+  job = run_query_async(
+      bigquery_client=bigquery_client,
+      dataset_id=dataset_id,
+      destination_table_name=destination_table_name,
+      query_sql=query_sql,
+      query_file=query_file,
+      location=location,
+      query_parameters=query_parameters,
+      time_partitioning_field=time_partitioning_field,
+      clustering_fields=clustering_fields,
+      max_bytes_billed=max_bytes_billed)
+  if download:
+    return job.result().to_dataframe(create_bqstorage_client=True)
+  job.result()
+  return bigquery_client.get_table(
+      f'{bigquery_client.project}.{dataset_id}.{destination_table_name}')
@@ -48,6 +48,36 @@ class FeatureEngineeringTest(unittest.TestCase):
 
     self.mock_read.assert_called_once()
 
+  def test_column_types_from_schema_respects_ignore_columns(self):
+    schema = [
+        bigquery.SchemaField('numerical_column', 'NUMERIC'),
+        bigquery.SchemaField('text_column', 'STRING'),
+    ]
+
+    input_data_types = feature_engineering._column_types_from_schema(
+        schema, ignore_columns=['text_column'])
+
+    self.assertEqual(dict(input_data_types),
+                     {'numeric': ['numerical_column']})
+
+  def test_check_query_cost_raises_when_over_limit(self):
+    dry_run_job = mock.Mock(total_bytes_processed=100)
+
+    with self.assertRaises(ValueError):
+      feature_engineering._check_query_cost(dry_run_job, max_bytes_billed=10)
+
+  def test_run_query_async_omits_bytes_billed_limit_when_unset(self):
+
+    feature_engineering.run_query_async(
+        bigquery_client=self.mock_client,
+        dataset_id=self.dataset_id,
+        query_sql='SELECT 1',
+        destination_table_name=self.destination_table_name)
+
+    job_config = self.mock_client.query.call_args.kwargs['job_config']
+    self.assertNotIn('maximumBytesBilled',
+                     job_config._properties.get('query', {}))
+
   def test_run_query_writes_file(self):
 
     feature_engineering.run_query(
@@ -14,6 +14,7 @@
 """Module for evaluating models built via CrystalValue pipeline."""
 
 import logging
+from typing import Collection, Dict, Tuple
 
 from google.cloud import bigquery
 import matplotlib.pyplot as plt
@@ -49,11 +50,13 @@ def get_test_set(bigquery_client: bigquery.Client,
   FROM {bigquery_client.project}.{dataset_id}.{table_name}
   WHERE {predefined_split_column} = 'TEST'
   """
-  return bigquery_client.query(query, location=location).result().to_dataframe()
+  return bigquery_client.query(
+      query, location=location).result().to_dataframe(
+          create_bqstorage_client=True)
 
 
 def _calculate_normalized_mae(y_actual: pd.Series,
-                              y_predicted: pd.Series) -> np.float:
+                              y_predicted: pd.Series) -> float:
   """Helper function for calculating bin level normalized mean absolute error.
 
   Args:
@@ -67,7 +70,7 @@ def _calculate_normalized_mae(y_actual: pd.Series,
       metrics.mean_absolute_error(y_actual, y_predicted), np.mean(y_actual))
 
 
-def _gini(series1: pd.Series, series2: pd.Series) -> np.float64:
+def _gini(series1: pd.Series, series2: pd.Series) -> float:
   """Returns Gini coefficient between two series.
 
   Args:
@@ -77,18 +80,18 @@ def _gini(series1: pd.Series, series2: pd.Series) -> np.float64:
   Returns:
     Gini coefficient between the two series.
   """
-  y_all = np.asarray(
-      np.c_[series1, series2, np.arange(len(series1))], dtype=np.float)
-  y_all_sorted_desc = y_all[np.lexsort((y_all[:, 2], -1 * y_all[:, 1]))]
-  total_series1 = y_all_sorted_desc[:, 0].sum()
-  gini_raw_numerator = y_all_sorted_desc[:, 0].cumsum().sum()
-  gini_sum = gini_raw_numerator / total_series1
-  gini_sum_adjusted = gini_sum - (len(series1) + 1) / 2.
-  return gini_sum_adjusted / len(series1)
+  values = np.asarray(series1, dtype=float)
+  # Sort by the second series descending, breaking ties by original order.
+  sort_descending = np.lexsort(
+      (np.arange(len(values)), -np.asarray(series2, dtype=float)))
+  cumulative_values = values[sort_descending].cumsum()
+  gini_sum = cumulative_values.sum() / values.sum()
+  gini_sum_adjusted = gini_sum - (len(values) + 1) / 2.
+  return gini_sum_adjusted / len(values)
 
 
 def _compute_gini_normalized(y_actual: pd.Series,
-                             y_predicted: pd.Series) -> np.float:
+                             y_predicted: pd.Series) -> float:
   """Produces normalized Gini coefficient between actual and predicted LTV.
 
   Args:
@@ -101,6 +104,176 @@ def _compute_gini_normalized(y_actual: pd.Series,
   return np.divide(_gini(y_actual, y_predicted), _gini(y_actual, y_actual))
 
 
+def _assign_prediction_bins(predictions: pd.Series,
+                            number_bins: int,
+                            use_approx: bool = True) -> np.ndarray:
+  """Assigns predictions to bins with bin 1 holding the highest predictions.
+
+  Args:
+    predictions: The series with predicted LTV for test set customers.
+    number_bins: Number of bins to split the LTV predictions into.
+    use_approx: Whether to assign bins by bucketing predictions between
+      quantile boundaries rather than ranking every row. Bucketing skips the
+      per-row rank assignment, at the cost of slightly uneven bins when
+      predictions have ties.
+
+  Returns:
+    Array with the bin number for each prediction.
+  """
+  if use_approx:
+    quantiles = np.quantile(predictions,
+                            np.linspace(0, 1, number_bins + 1)[1:-1])
+    return number_bins - np.digitize(predictions, quantiles)
+  return pd.qcut(
+      predictions.rank(method='first'),
+      number_bins,
+      labels=np.arange(number_bins, 0, -1)).astype(int)
+
+
+def _top_value_shares(
+    future_value: pd.Series,
+    predicted_value: pd.Series,
+    shares: Collection[float] = (0.01, 0.05, 0.10)) -> Dict[str, float]:
+  """Computes the share of total value held by the top predicted customers.
+
+  Args:
+    future_value: The series with actual LTV for test set customers.
+    predicted_value: The series with predicted LTV for test set customers.
+    shares: Fractions of customers, ranked by predicted LTV descending, to
+      report value shares for.
+
+  Returns:
+    Mapping of metric name to the share of total actual value held by each
+    top fraction of customers.
+  """
+  total_value = future_value.sum()
+  value_by_prediction_desc = future_value.to_numpy()[np.argsort(
+      -predicted_value.to_numpy(), kind='stable')]
+  cumulative_value = value_by_prediction_desc.cumsum()
+  value_shares = {}
+  for share in shares:
+    number_of_rows = int(share * len(future_value))
+    top_customers_value = (
+        cumulative_value[number_of_rows - 1] if number_of_rows else 0.)
+    value_shares[
+        f'top_{int(share * 100)}_percent_predicted_customers_value_share'
+    ] = np.divide(top_customers_value, total_value)
+  return value_shares
+
+
+def _evaluate_scored_table_in_bigquery(
+    bigquery_client: bigquery.Client,
+    dataset_id: str,
+    scored_table_name: str,
+    location: str,
+    number_bins: int) -> Tuple[pd.DataFrame, pd.Series]:
+  """Computes bin level and overall evaluation metrics inside BigQuery.
+
+  The aggregations run in parallel on BigQuery slots and only the per-bin
+  averages plus a single metrics row cross the wire, instead of the raw
+  scored test set. Bins are assigned with APPROX_QUANTILES boundaries and
+  match `_assign_prediction_bins` with bin 1 holding the highest predictions.
+
+  Args:
+    bigquery_client: BigQuery client.
+    dataset_id: The Bigquery dataset_id.
+    scored_table_name: Table with `future_value` and `predicted_value`
+      columns for the scored test set.
+    location: Bigquery data location.
+    number_bins: Number of bins to split the LTV predictions into.
+
+  Returns:
+    The per-bin average predicted and actual LTV, and a series with the
+    overall metrics (Spearman correlation, normalized Gini, normalized MAE
+    and top 1/5/10% revenue shares).
+  """
+  table_id = f'{bigquery_client.project}.{dataset_id}.{scored_table_name}'
+  job_config = bigquery.QueryJobConfig(query_parameters=[
+      bigquery.ScalarQueryParameter('number_bins', 'INT64', number_bins)
+  ])
+
+  bin_query = f"""
+  WITH
+    QuantileInfo AS (
+      SELECT APPROX_QUANTILES(predicted_value, @number_bins) AS quantiles
+      FROM `{table_id}`
+    ),
+    Binned AS (
+      SELECT
+        future_value,
+        predicted_value,
+        @number_bins - RANGE_BUCKET(
+          predicted_value,
+          ARRAY(
+            SELECT quantile
+            FROM QuantileInfo, UNNEST(QuantileInfo.quantiles) AS quantile
+              WITH OFFSET AS quantile_offset
+            WHERE quantile_offset BETWEEN 1 AND @number_bins - 1
+            ORDER BY quantile_offset)) AS bin
+      FROM `{table_id}`
+    )
+  SELECT
+    bin,
+    AVG(predicted_value) AS mean_predicted_value,
+    AVG(future_value) AS mean_future_value
+  FROM Binned
+  GROUP BY bin
+  ORDER BY bin
+  """
+  bin_summary = bigquery_client.query(
+      bin_query, job_config=job_config, location=location).result(
+      ).to_dataframe(create_bqstorage_client=True)
+
+  metrics_query = f"""
+  WITH
+    Ranked AS (
+      SELECT
+        future_value,
+        predicted_value,
+        RANK() OVER (ORDER BY future_value)
+          + (COUNT(*) OVER (PARTITION BY future_value) - 1) / 2 AS actual_rank,
+        RANK() OVER (ORDER BY predicted_value)
+          + (COUNT(*) OVER (PARTITION BY predicted_value) - 1) / 2
+          AS predicted_rank,
+        ROW_NUMBER() OVER (ORDER BY predicted_value DESC) AS prediction_order,
+        SUM(future_value) OVER (
+          ORDER BY predicted_value DESC ROWS UNBOUNDED PRECEDING)
+          AS cumulative_value_by_prediction,
+        SUM(future_value) OVER (
+          ORDER BY future_value DESC ROWS UNBOUNDED PRECEDING)
+          AS cumulative_value_by_actual,
+        COUNT(*) OVER () AS row_count
+      FROM `{table_id}`
+    )
+  SELECT
+    CORR(actual_rank, predicted_rank) AS spearman_correlation,
+    SAFE_DIVIDE(
+      SUM(cumulative_value_by_prediction) / SUM(future_value)
+        - (COUNT(*) + 1) / 2,
+      SUM(cumulative_value_by_actual) / SUM(future_value)
+        - (COUNT(*) + 1) / 2) AS gini_normalized,
+    SAFE_DIVIDE(AVG(ABS(future_value - predicted_value)), AVG(future_value))
+      AS normalised_mae,
+    SAFE_DIVIDE(
+      SUM(IF(prediction_order <= CAST(FLOOR(0.01 * row_count) AS INT64),
+             future_value, 0)),
+      SUM(future_value)) AS top_1_percent_predicted_customers_value_share,
+    SAFE_DIVIDE(
+      SUM(IF(prediction_order <= CAST(FLOOR(0.05 * row_count) AS INT64),
+             future_value, 0)),
+      SUM(future_value)) AS top_5_percent_predicted_customers_value_share,
+    SAFE_DIVIDE(
+      SUM(IF(prediction_order <= CAST(FLOOR(0.10 * row_count) AS INT64),
+             future_value, 0)),
+      SUM(future_value)) AS top_10_percent_predicted_customers_value_share
+  FROM Ranked
+  """
+  metrics = bigquery_client.query(
+      metrics_query, location=location).result().to_dataframe(
+          create_bqstorage_client=True).iloc[0]
+  return bin_summary, metrics
+
+
 def _plot_summary_stats(bin_data: pd.DataFrame) -> None:
   """Creates plots with key evaluation metrics for LTV model.
 
@@ -137,6 +310,8 @@ def evaluate_model_predictions(
     table_evaluation_stats: str = 'test_set_evaluation',
     location: str = 'europe-west4',
     number_bins: int = 10,
+    use_approx: bool = True,
+    use_bigquery: bool = False,
     round_decimal_places: int = 2) -> pd.DataFrame:
   """Creates a plot and BigQuery table with evaluation metrics for LTV model.
 
@@ -157,6 +332,18 @@ def evaluate_model_predictions(
     location: Bigquery data location.
     number_bins: Number of bins to split the LTV predictions into for
       evaluation. The default split is into deciles.
+    use_approx: Whether to assign bins using approximate quantile boundaries
+      rather than an exact global rank. The approximate assignment avoids
+      fully sorting the predictions, which matters on large test sets; exact
+      ranking can be useful for very small tables. Only used when
+      `use_bigquery` is False; the BigQuery path always buckets with
+      APPROX_QUANTILES.
+    use_bigquery: Whether to compute the binning and evaluation metrics
+      inside BigQuery. The scored test set already resides in local memory
+      (the endpoint scores the downloaded test set in Python), so by default
+      the metrics are aggregated in memory; set to True to load the scored
+      rows to a `{table_evaluation_stats}_scored` table and aggregate on
+      BigQuery slots instead, which can help when local memory is tight.
     round_decimal_places: The number of decimal places to round to.
 
   Returns:
@@ -180,36 +367,54 @@ def evaluate_model_predictions(
       features=data,
       location=location)
 
-  spearman_correlation = round(
-      stats.spearmanr(data['future_value'], data['predicted_value'])[0],
-      round_decimal_places)
-  gini_normalized = round(
-      _compute_gini_normalized(data['future_value'], data['predicted_value']),
-      round_decimal_places)
-  normalised_mae = round(
-      _calculate_normalized_mae(data['future_value'], data['predicted_value']),
-      round_decimal_places)
-
-  data['bin'] = pd.qcut(
-      data['predicted_value'].rank(method='first'),
-      number_bins,
-      labels=np.arange(number_bins, 0, -1)).astype(int)
-
-  revenue_shares = pd.DataFrame().append(
-      pd.Series(dtype='object'), ignore_index=True)
-  total_value = data['future_value'].sum()
-  data = data.sort_values('predicted_value', ascending=False)
-  for i in [0.01, 0.05, 0.10]:
-    number_of_rows = int(i * len(data))
-    revenue_shares[
-        f'top_{int(i * 100)}_percent_predicted_customers_value_share'] = np.divide(
-            data[:number_of_rows]['future_value'].sum(), total_value)
-  revenue_shares = revenue_shares.round(round_decimal_places)
-
-  bin_summary = data.groupby('bin')[['predicted_value', 'future_value'
-                                    ]].mean().round(round_decimal_places)
-  bin_summary.columns = [f'mean_{column}' for column in bin_summary.columns]
-  bin_summary = bin_summary.reset_index()
+  if use_bigquery:
+    scored_table_name = f'{table_evaluation_stats}_scored'
+    feature_engineering.run_load_table_to_bigquery(
+        data=data[['future_value', 'predicted_value']],
+        bigquery_client=bigquery_client,
+        dataset_id=dataset_id,
+        table_name=scored_table_name,
+        location=location)
+    bin_summary, metrics = _evaluate_scored_table_in_bigquery(
+        bigquery_client=bigquery_client,
+        dataset_id=dataset_id,
+        scored_table_name=scored_table_name,
+        location=location,
+        number_bins=number_bins)
+    bin_summary = bin_summary.round(round_decimal_places)
+    spearman_correlation = round(metrics['spearman_correlation'],
+                                 round_decimal_places)
+    gini_normalized = round(metrics['gini_normalized'], round_decimal_places)
+    normalised_mae = round(metrics['normalised_mae'], round_decimal_places)
+    revenue_shares = pd.DataFrame([{
+        column: metrics[column]
+        for column in metrics.index
+        if column.endswith('_value_share')
+    }]).round(round_decimal_places)
+  else:
+    spearman_correlation = round(
+        stats.spearmanr(data['future_value'], data['predicted_value'])[0],
+        round_decimal_places)
+    gini_normalized = round(
+        _compute_gini_normalized(data['future_value'],
+                                 data['predicted_value']),
+        round_decimal_places)
+    normalised_mae = round(
+        _calculate_normalized_mae(data['future_value'],
+                                  data['predicted_value']),
+        round_decimal_places)
+
+    data['bin'] = _assign_prediction_bins(
+        data['predicted_value'], number_bins, use_approx=use_approx)
+
+    revenue_shares = pd.DataFrame([
+        _top_value_shares(data['future_value'], data['predicted_value'])
+    ]).round(round_decimal_places)
+
+    bin_summary = data.groupby('bin')[['predicted_value', 'future_value'
+                                      ]].mean().round(round_decimal_places)
+    bin_summary.columns = [f'mean_{column}' for column in bin_summary.columns]
+    bin_summary = bin_summary.reset_index()
   _plot_summary_stats(bin_data=bin_summary)
 
   model_summary_statistics = pd.DataFrame.from_records([{
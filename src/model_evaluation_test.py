@@ -0,0 +1,88 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for crystalvalue.model_evaluation."""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src import model_evaluation
+
+
+class ModelEvaluationTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.actual = pd.Series([10., 0., 30., 20., 50., 40.])
+    self.predicted = pd.Series([30., 10., 20., 50., 40., 60.])
+
+  def test_gini_matches_reference_value(self):
+    self.assertAlmostEqual(
+        model_evaluation._gini(self.actual, self.predicted),
+        0.1166666666666667)
+
+  def test_gini_of_series_with_itself(self):
+    self.assertAlmostEqual(
+        model_evaluation._gini(self.actual, self.actual),
+        0.1944444444444445)
+
+  def test_compute_gini_normalized_matches_reference_value(self):
+    self.assertAlmostEqual(
+        model_evaluation._compute_gini_normalized(self.actual, self.predicted),
+        0.6)
+
+  def test_compute_gini_normalized_perfect_prediction(self):
+    self.assertAlmostEqual(
+        model_evaluation._compute_gini_normalized(self.actual, self.actual),
+        1.0)
+
+  def test_assign_prediction_bins_exact(self):
+    predictions = pd.Series([10., 20., 30., 40., 50., 60.])
+
+    bins = model_evaluation._assign_prediction_bins(
+        predictions, number_bins=3, use_approx=False)
+
+    self.assertEqual(list(bins), [3, 3, 2, 2, 1, 1])
+
+  def test_assign_prediction_bins_approx_matches_exact_without_ties(self):
+    predictions = pd.Series([10., 20., 30., 40., 50., 60.])
+
+    bins = model_evaluation._assign_prediction_bins(
+        predictions, number_bins=3, use_approx=True)
+
+    self.assertEqual(list(bins), [3, 3, 2, 2, 1, 1])
+
+  def test_top_value_shares_matches_reference_values(self):
+    generator = np.random.RandomState(7)
+    future_value = pd.Series(generator.gamma(2., 50., 100).round(2))
+    predicted_value = (future_value +
+                       generator.normal(0., 30., 100)).round(2)
+
+    value_shares = model_evaluation._top_value_shares(
+        future_value, predicted_value)
+
+    self.assertAlmostEqual(
+        value_shares['top_1_percent_predicted_customers_value_share'],
+        0.02867853179158859)
+    self.assertAlmostEqual(
+        value_shares['top_5_percent_predicted_customers_value_share'],
+        0.1263345082452503)
+    self.assertAlmostEqual(
+        value_shares['top_10_percent_predicted_customers_value_share'],
+        0.23075984475035066)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -29,9 +29,9 @@ WITH
     SELECT
       CAST(TX_DATA.{customer_id_column} AS STRING) AS customer_id,
       WindowDate.date AS window_date,
-      DATE_SUB((WindowDate.date), INTERVAL {days_lookback} day) AS lookback_start,
+      DATE_SUB((WindowDate.date), INTERVAL @days_lookback day) AS lookback_start,
       DATE_ADD((WindowDate.date), INTERVAL 1 day) AS lookahead_start,
-      DATE_ADD((WindowDate.date), INTERVAL {days_lookahead} day) AS lookahead_stop
+      DATE_ADD((WindowDate.date), INTERVAL @days_lookahead day) AS lookahead_stop
     FROM {project_id}.{dataset_id}.{table_name} AS TX_DATA
     CROSS JOIN WindowDate
     GROUP BY 1, 2, 3, 4
@@ -40,10 +40,10 @@ SELECT
   CustomerWindows.*,
   IFNULL(
     DATE_DIFF(CustomerWindows.window_date, MAX(DATE(TX_DATA.{date_column})), DAY),
-    {days_lookback}) AS days_since_last_transaction,
+    @days_lookback) AS days_since_last_transaction,
   IFNULL(
     DATE_DIFF(CustomerWindows.window_date, MIN(DATE(TX_DATA.{date_column})), DAY),
-    {days_lookback}) AS days_since_first_transaction,
+    @days_lookback) AS days_since_first_transaction,
   COUNT(*) AS count_transactions,
   {features_sql}
 FROM
@@ -38,20 +38,20 @@ WITH
           DATE_ADD(
             DATE(
               (SELECT MIN({date_column}) FROM {project_id}.{dataset_id}.{table_name})),
-            INTERVAL {days_lookback} DAY),
+            INTERVAL @days_lookback DAY),
           DATE_SUB(
             DATE(
               (SELECT MAX({date_column}) FROM {project_id}.{dataset_id}.{table_name})),
-            INTERVAL {days_lookahead} DAY),
+            INTERVAL @days_lookahead DAY),
           INTERVAL 1 MONTH)) AS window_date
   ),
   CustomerWindows AS (
     SELECT DISTINCT
       CAST(TX_DATA.{customer_id_column} AS STRING) AS customer_id,
       DateWindowsTable.window_date AS window_date,
-      DATE_SUB(DateWindowsTable.window_date, INTERVAL {days_lookback} day) AS lookback_start,
+      DATE_SUB(DateWindowsTable.window_date, INTERVAL @days_lookback day) AS lookback_start,
       DATE_ADD(DateWindowsTable.window_date, INTERVAL 1 day) AS lookahead_start,
-      DATE_ADD(DateWindowsTable.window_date, INTERVAL {days_lookahead} day) AS lookahead_stop,
+      DATE_ADD(DateWindowsTable.window_date, INTERVAL @days_lookahead day) AS lookahead_stop,
       ROW_NUMBER()
         OVER (PARTITION BY CAST(TX_DATA.{customer_id_column} AS STRING) ORDER BY RAND()) AS customer_window_number
     FROM {project_id}.{dataset_id}.{table_name} AS TX_DATA
@@ -97,10 +97,10 @@ SELECT
     END AS predefined_split_column,
   IFNULL(
     DATE_DIFF(Target.window_date, MAX(DATE(TX_DATA.{date_column})), DAY),
-    {days_lookback}) AS days_since_last_transaction,
+    @days_lookback) AS days_since_last_transaction,
   IFNULL(
     DATE_DIFF(Target.window_date, MIN(DATE(TX_DATA.{date_column})), DAY),
-    {days_lookback}) AS days_since_first_transaction,
+    @days_lookback) AS days_since_first_transaction,
   COUNT(*) AS count_transactions,
   {features_sql}
 FROM